@@ -37,6 +37,9 @@ setup(name="pipelinewise-target-snowflake",
           # for snowflake-connector-python==3.0.4, segmentation fault on macOS for more recent versions) that don't
           # currently seem possible to fully resolve cross-platform.
           'numpy==1.26.4',
+          'orjson==3.8.3',
+          'isal==1.8.0',
+          'zstandard==0.25.0',
       ],
       extras_require={
           "test": [
@@ -19,7 +19,7 @@ from target_snowflake.file_formats import parquet
 from target_snowflake import stream_utils
 
 from target_snowflake.db_sync import DbSync
-from target_snowflake.file_format import FileFormatTypes
+from target_snowflake.file_format import CompressionTypes, FileFormatTypes
 from target_snowflake.exceptions import (
     RecordValidationException,
     UnexpectedValueTypeException,
@@ -519,16 +519,19 @@ def flush_records(stream: str,
     Returns:
         None
     """
+    # Count records before generating the file, some file formats consume the records
+    row_count = len(records)
+    compression = not no_compression and db_sync.connection_config.get('compression_type', CompressionTypes.GZIP)
+
     # Generate file on disk in the required format
     filepath = db_sync.file_format.formatter.records_to_file(records,
                                                              db_sync.flatten_schema,
-                                                             compression=not no_compression,
+                                                             compression=compression,
                                                              dest_dir=temp_dir,
                                                              data_flattening_max_level=
                                                              db_sync.data_flattening_max_level)
 
     # Get file stats
-    row_count = len(records)
     size_bytes = os.path.getsize(filepath)
 
     # Upload to s3 and load into Snowflake
@@ -8,7 +8,7 @@ from typing import List, Dict, Union, Tuple, Set
 from singer import get_logger
 from target_snowflake import flattening
 from target_snowflake import stream_utils
-from target_snowflake.file_format import FileFormat, FileFormatTypes
+from target_snowflake.file_format import CompressionTypes, FileFormat, FileFormatTypes
 
 from target_snowflake.exceptions import TooManyRecordsException, PrimaryKeyNotFoundException
 from target_snowflake.upload_clients.s3_upload_client import S3UploadClient
@@ -67,6 +67,12 @@ def validate_config(config):
     if archive_load_files and not config.get('s3_bucket', None):
         errors.append('Archive load files option can be used only with external s3 stages. Please define s3_bucket.')
 
+    # Check if compression type is supported
+    compression_type = config.get('compression_type', CompressionTypes.GZIP)
+    if compression_type not in CompressionTypes.list():
+        errors.append(f"Not supported compression_type: '{compression_type}'. "
+                      f"Supported compression types: {CompressionTypes.list()}")
+
     return errors
 
 
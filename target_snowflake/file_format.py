@@ -20,6 +20,20 @@ class FileFormatTypes(str, Enum):
         return list(map(lambda c: c.value, FileFormatTypes))
 
 
+# Supported compression types of the generated files.
+@unique
+class CompressionTypes(str, Enum):
+    """Enum of supported compression types"""
+
+    GZIP = 'gzip'
+    ZSTD = 'zstd'
+
+    @staticmethod
+    def list():
+        """List of supported compression type values"""
+        return list(map(lambda c: c.value, CompressionTypes))
+
+
 # pylint: disable=too-few-public-methods
 class FileFormat:
     """File Format class"""
@@ -1,13 +1,48 @@
 """CSV file format functions"""
 import gzip
 import json
+import math
 import os
 import re
+import threading
 
-from typing import Callable, Dict, List
+import orjson
+import zstandard
+
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple, Union
 from tempfile import mkstemp
 
 from target_snowflake import flattening
+from target_snowflake.file_format import CompressionTypes
+
+try:
+    # ISA-L deflate is several times faster than zlib, fall back to zlib where isal is not available
+    from isal import igzip_threaded
+except ImportError:
+    igzip_threaded = None
+
+# Size of CSV lines in bytes collected in memory before writing them to the output file in one call.
+# Compressors work more efficiently on larger blocks than on individual lines.
+WRITE_BUFFER_SIZE_BYTES = 256 * 1024
+
+# Buffer size of the generated files, compressed data is written to it in many small chunks
+FILE_BUFFER_SIZE_BYTES = 1024 * 1024
+
+# Write buffers are allocated once per thread and reused by every batch flushed by the thread
+_WRITE_BUFFERS = threading.local()
+
+_NEWLINE = ord('\n')
+
+# Gzip compression level of the generated files. Favours speed, files are deleted once loaded into Snowflake
+GZIP_COMPRESSION_LEVEL = 1
+
+# Zstandard compression level of the generated files
+ZSTD_COMPRESSION_LEVEL = 3
+
+# Number of background threads compressing a file while records are being converted to CSV lines.
+# Kept low because multiple streams are already flushed in parallel.
+COMPRESSION_THREADS = 1
 
 
 def create_copy_sql(table_name: str,
@@ -18,7 +53,7 @@ def create_copy_sql(table_name: str,
                     restrict_file_pattern: bool = False,
                     ) -> str:
     """Generate a CSV compatible snowflake COPY INTO command"""
-    p_columns = ', '.join([c['name'] for c in columns])
+    p_columns = _column_clauses(_columns_key(columns))[0]
 
     select_statement = select_from_stage(columns, file_format_name, s3_key, stage_name, restrict_file_pattern)
 
@@ -34,9 +69,7 @@ def create_merge_sql(table_name: str,
                      restrict_file_pattern: bool = False,
                      ) -> str:
     """Generate a CSV compatible snowflake MERGE INTO command"""
-    p_update = ', '.join([f"{c['name']}=s.{c['name']}" for c in columns])
-    p_insert_cols = ', '.join([c['name'] for c in columns])
-    p_insert_values = ', '.join([f"s.{c['name']}" for c in columns])
+    p_insert_cols, p_update, p_insert_values, _ = _column_clauses(_columns_key(columns))
 
     select_statement = select_from_stage(columns, file_format_name, s3_key, stage_name, restrict_file_pattern)
 
@@ -49,94 +82,245 @@ def create_merge_sql(table_name: str,
 
 
 def select_from_stage(columns, file_format_name, s3_key, stage_name, restrict_file_pattern=False):
+    """Generate a SELECT statement that reads the columns of a CSV file from a snowflake stage"""
+    p_source_columns = _column_clauses(_columns_key(columns))[3]
+
+    options_clause = f"FILE_FORMAT => '{file_format_name}'"
+    if restrict_file_pattern:
+        # Include the s3_key as a pattern, to exclude other keys that have this key as a prefix
+        options_clause += f", PATTERN => '{re.escape(s3_key)}'"
+
+    return f"SELECT {p_source_columns} FROM '@{stage_name}/{s3_key}' ({options_clause})"
+
+
+def _columns_key(columns: List) -> Tuple:
+    """Convert a list of column dictionaries to a hashable key of _column_clauses"""
+    return tuple((c['name'], c.get('trans'), c.get('value')) for c in columns)
+
+
+@lru_cache(maxsize=128)
+def _column_clauses(columns: Tuple) -> Tuple[str, str, str, str]:
+    """
+    Generate the column specific clauses of COPY and MERGE commands
+
+    Cached, because every batch of a stream is loaded with the same columns.
+
+    Args:
+        columns: Tuple of (name, trans, value) tuples, see _columns_key
+
+    Returns:
+        Tuple of column names, MERGE update clause, MERGE insert values and SELECT column expressions
+    """
+    p_columns = ', '.join([name for name, _, _ in columns])
+    p_update = ', '.join([f"{name}=s.{name}" for name, _, _ in columns])
+    p_insert_values = ', '.join([f"s.{name}" for name, _, _ in columns])
+
     column_expressions = []
     idx = 0
-    for column in columns:
-        expr = column['value']
-        if not expr:
+    for name, trans, value in columns:
+        if value:
+            column_expressions.append(f"{value} {name}")
+        else:
             idx += 1
-            expr = f"{column['trans']}(${idx})"
-        full_expr = ' '.join([expr, column['name']])
-        column_expressions.append(full_expr)
+            column_expressions.append(f"{trans}(${idx}) {name}")
 
     p_source_columns = ', '.join(column_expressions)
 
-    select_options = {
-        'FILE_FORMAT': file_format_name,
-    }
-    if restrict_file_pattern:
-        # Include the s3_key as a pattern, to exclude other keys that have this key as a prefix
-        select_options['PATTERN'] = re.escape(s3_key)
-    options_clause = ', '.join([f"{k} => '{v}'" for k, v in select_options.items()])
+    return p_columns, p_update, p_insert_values, p_source_columns
+
+
+def _json_dumps_int(value: int) -> bytes:
+    """JSON encodes an integer"""
+    return b'%d' % value
+
+
+def _json_dumps_float(value: float) -> bytes:
+    """JSON encodes a float, NaN and infinity the same way as the json module does"""
+    return repr(value).encode() if math.isfinite(value) else json.dumps(value).encode()
+
+
+def _json_dumps_bool(value: bool) -> bytes:
+    """JSON encodes a boolean"""
+    return b'true' if value else b'false'
+
+
+def _json_dumps(value) -> bytes:
+    """
+    JSON encodes a CSV field value of any type with orjson
+
+    Values are encoded exactly as json.dumps(value, ensure_ascii=False) would do,
+    except for dicts and lists, which orjson encodes without spaces.
+
+    Args:
+        value: Field value to encode
 
-    select_from_stage = f"SELECT {p_source_columns} FROM '@{stage_name}/{s3_key}' ({options_clause})"
-    return select_from_stage
+    Returns:
+        UTF-8 encoded JSON of the value
+    """
+    try:
+        return orjson.dumps(value)
+    except orjson.JSONEncodeError:
+        # orjson doesn't support everything the standard library does, e.g. integers wider than 64 bits
+        return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+# JSON encoders of the most common CSV field value types, keyed by exact type. Values of any
+# other type are encoded by _json_dumps.
+_JSON_ENCODERS = {
+    str: orjson.dumps,
+    int: _json_dumps_int,
+    float: _json_dumps_float,
+    bool: _json_dumps_bool,
+}
+
+
+def build_csv_encoder(schema: Dict, data_flattening_max_level: int = 0) -> Callable[[Dict], bytes]:
+    """
+    Builds a function that transforms record messages of a schema to CSV lines
+
+    Everything that depends only on the schema is done once here, the returned function
+    does the per record work only.
+
+    Args:
+        schema: JSONSchema of the records
+        data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+
+    Returns:
+        Function that transforms a record dictionary to a CSV line in bytes
+    """
+    columns = tuple(schema)
+    json_columns = flattening.json_dumped_columns(schema)
+
+    def record_to_csv_line_transformer(record: Dict) -> bytes:
+        values = flattening.flatten_record_values(record, columns, schema, data_flattening_max_level, json_columns)
+
+        # Missing columns and None values are both written as empty fields
+        return b','.join(
+            [
+                _JSON_ENCODERS.get(type(value), _json_dumps)(value) if value == 0 or value else b''
+                for value in values
+            ]
+        )
+
+    return record_to_csv_line_transformer
 
 
 def record_to_csv_line(record: dict,
                        schema: dict,
-                       data_flattening_max_level: int = 0) -> str:
+                       data_flattening_max_level: int = 0) -> bytes:
     """
     Transforms a record message to a CSV line
 
+    Use build_csv_encoder to transform many records with the same schema.
+
     Args:
         record: Dictionary that represents a csv line. Dict key is column name, value is the column value
         schema: JSONSchema of the record
         data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
 
     Returns:
-        string of csv line
+        UTF-8 encoded bytes of csv line
     """
-    flatten_record = flattening.flatten_record(record, schema, max_level=data_flattening_max_level)
+    return build_csv_encoder(schema, data_flattening_max_level)(record)
+
 
-    return ','.join(
-        [
-            json.dumps(flatten_record[column], ensure_ascii=False) if column in flatten_record and (
-                    flatten_record[column] == 0 or flatten_record[column]) else ''
-            for column in schema
-        ]
-    )
+def _get_write_buffer() -> bytearray:
+    """Get the write buffer of the current thread, allocate it on first use"""
+    buffer = getattr(_WRITE_BUFFERS, 'buffer', None)
+    if buffer is None:
+        buffer = _WRITE_BUFFERS.buffer = bytearray(WRITE_BUFFER_SIZE_BYTES)
+
+    return buffer
 
 
 def write_records_to_file(outfile,
                           records: Dict,
-                          schema: Dict,
-                          record_to_csv_line_transformer: Callable,
-                          data_flattening_max_level: int = 0) -> None:
+                          record_to_csv_line_transformer: Callable[[Dict], bytes]) -> None:
     """
     Writes a record message to a given file
 
+    Records are removed from the records dictionary once written, to release their memory
+    while the file is being generated. The dictionary is empty when the function returns.
+
     Args:
         outfile: An open file object
-        records: List of dictionaries that represents a batch of singer record messages
-        schema: JSONSchema of the records
-        record_to_csv_line_transformer: Function that transforms dictionary to a CSV string line
-        data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+        records: List of dictionaries that represents a batch of singer record messages. Consumed by the function
+        record_to_csv_line_transformer: Function that transforms dictionary to a CSV line in bytes, see
+                                        build_csv_encoder
 
     Returns:
         None
     """
-    for record in records.values():
-        csv_line = record_to_csv_line_transformer(record, schema, data_flattening_max_level)
-        outfile.write(bytes(csv_line + '\n', 'UTF-8'))
+    buffer = _get_write_buffer()
+    buffer_size = len(buffer)
+    position = 0
+
+    with memoryview(buffer) as view:
+        for key in list(records):
+            csv_line = record_to_csv_line_transformer(records.pop(key))
+            line_end = position + len(csv_line)
+
+            if line_end >= buffer_size:
+                outfile.write(view[:position])
+                position = 0
+                line_end = len(csv_line)
+
+                # Line doesn't fit into the buffer at all, write it directly
+                if line_end >= buffer_size:
+                    outfile.write(csv_line)
+                    outfile.write(b'\n')
+                    continue
+
+            view[position:line_end] = csv_line
+            view[line_end] = _NEWLINE
+            position = line_end + 1
+
+        if position:
+            outfile.write(view[:position])
+
+
+def _open_gzip_writer(fileobj, filename: str):
+    """
+    Opens a gzip file object that writes compressed data to fileobj
+
+    Compression runs in background threads with isal, so it happens in parallel with
+    generating the CSV lines, which holds the GIL. Uses the standard gzip module if isal
+    is not available.
+    """
+    if igzip_threaded:
+        return igzip_threaded.open(fileobj, mode='wb', compresslevel=GZIP_COMPRESSION_LEVEL,
+                                   threads=COMPRESSION_THREADS)
+
+    return gzip.GzipFile(filename=filename, mode='wb', compresslevel=GZIP_COMPRESSION_LEVEL, fileobj=fileobj)
+
+
+def _open_zstd_writer(fileobj):
+    """Opens a zstandard file object that writes compressed data to fileobj in background threads"""
+    compressor = zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL, threads=COMPRESSION_THREADS)
+    return compressor.stream_writer(fileobj, closefd=False)
 
 
 def records_to_file(records: Dict,
                     schema: Dict,
                     suffix: str = 'csv',
                     prefix: str = 'batch_',
-                    compression: bool = False,
+                    compression: Union[bool, str] = False,
                     dest_dir: str = None,
                     data_flattening_max_level: int = 0):
     """
     Transforms a list of dictionaries with records messages to a CSV file
 
+    Records are converted and written one by one, memory used on top of the records is
+    bounded by WRITE_BUFFER_SIZE_BYTES and the compression buffers, regardless of the batch size.
+    Written records are removed from records, the dictionary is empty when the function returns.
+
     Args:
-        records: List of dictionaries that represents a batch of singer record messages
+        records: List of dictionaries that represents a batch of singer record messages. Consumed by the function
         schema: JSONSchema of the records
         suffix: Generated filename suffix
         prefix: Generated filename prefix
-        compression: Gzip compression enabled or not (Default: False)
+        compression: Compression type of the file, one of CompressionTypes. True means gzip,
+                     False means uncompressed. (Default: False)
         dest_dir: Directory where the CSV file will be generated. (Default: OS specificy temp directory)
         data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
 
@@ -146,20 +330,27 @@ def records_to_file(records: Dict,
     if dest_dir:
         os.makedirs(dest_dir, exist_ok=True)
 
-    if compression:
+    if compression == CompressionTypes.ZSTD:
+        file_suffix = f'.{suffix}.zst'
+    elif compression:
         file_suffix = f'.{suffix}.gz'
     else:
         file_suffix = f'.{suffix}'
 
     filedesc, filename = mkstemp(suffix=file_suffix, prefix=prefix, dir=dest_dir)
-
-    # Using gzip or plain file object
-    if compression:
-        with open(filedesc, 'wb') as outfile:
-            with gzip.GzipFile(filename=filename, mode='wb',fileobj=outfile) as gzipfile:
-                write_records_to_file(gzipfile, records, schema, record_to_csv_line, data_flattening_max_level)
+    record_to_csv_line_transformer = build_csv_encoder(schema, data_flattening_max_level)
+
+    # Using zstandard, gzip or plain file object
+    if compression == CompressionTypes.ZSTD:
+        with open(filedesc, 'wb', buffering=FILE_BUFFER_SIZE_BYTES) as outfile:
+            with _open_zstd_writer(outfile) as zstdfile:
+                write_records_to_file(zstdfile, records, record_to_csv_line_transformer)
+    elif compression:
+        with open(filedesc, 'wb', buffering=FILE_BUFFER_SIZE_BYTES) as outfile:
+            with _open_gzip_writer(outfile, filename) as gzipfile:
+                write_records_to_file(gzipfile, records, record_to_csv_line_transformer)
     else:
-        with open(filedesc, 'wb') as outfile:
-            write_records_to_file(outfile, records, schema, record_to_csv_line, data_flattening_max_level)
+        with open(filedesc, 'wb', buffering=FILE_BUFFER_SIZE_BYTES) as outfile:
+            write_records_to_file(outfile, records, record_to_csv_line_transformer)
 
     return filename
@@ -1,8 +1,11 @@
 """Parquet file format functions"""
 import os
 import pandas
+import pyarrow
 
-from typing import Dict, List
+from pyarrow import parquet as pq
+
+from typing import Dict, List, Union
 from tempfile import mkstemp
 
 from target_snowflake import flattening
@@ -69,11 +72,39 @@ def records_to_dataframe(records: Dict,
     return pandas.DataFrame(data=flattened_records)
 
 
+def records_to_table(records: Dict,
+                     schema: Dict,
+                     data_flattening_max_level: int = 0) -> pyarrow.Table:
+    """
+    Transforms a list of record messages into an arrow table with flattened records
+
+    The table has one column for every column of the schema, columns are built
+    directly from the flattened values without a pandas dataframe in between.
+
+    Args:
+        records: List of dictionaries that represents a batch of singer record messages
+        schema: JSONSchema of the records
+        data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+
+    Returns:
+        Arrow table
+    """
+    columns = tuple(schema)
+    json_columns = flattening.json_dumped_columns(schema)
+    rows = [
+        flattening.flatten_record_values(record, columns, schema, data_flattening_max_level, json_columns)
+        for record in records.values()
+    ]
+
+    return pyarrow.Table.from_arrays([pyarrow.array([row[idx] for row in rows]) for idx in range(len(columns))],
+                                     names=list(columns))
+
+
 def records_to_file(records: Dict,
                     schema: Dict,
                     suffix: str = 'parquet',
                     prefix: str = 'batch_',
-                    compression: bool = False,
+                    compression: Union[bool, str] = False,
                     dest_dir: str = None,
                     data_flattening_max_level: int = 0):
     """
@@ -84,7 +115,8 @@ def records_to_file(records: Dict,
         schema: JSONSchema of the records
         suffix: Generated filename suffix
         prefix: Generated filename prefix
-        compression: Gzip compression enabled or not (Default: False)
+        compression: Compression enabled or not. Compressed parquet files use snappy regardless of
+                     the compression type. (Default: False)
         dest_dir: Directory where the parquet file will be generated. (Default: OS specificy temp directory)
         data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
 
@@ -96,14 +128,14 @@ def records_to_file(records: Dict,
 
     if compression:
         file_suffix = f'.{suffix}.gz'
-        parquet_compression='gzip'
+        parquet_compression = 'snappy'
     else:
         file_suffix = f'.{suffix}'
-        parquet_compression = None
+        parquet_compression = 'none'
 
     filename = mkstemp(suffix=file_suffix, prefix=prefix, dir=dest_dir)[1]
 
-    dataframe = records_to_dataframe(records, schema, data_flattening_max_level)
-    dataframe.to_parquet(filename, compression=parquet_compression)
+    table = records_to_table(records, schema, data_flattening_max_level)
+    pq.write_table(table, filename, compression=parquet_compression)
 
     return filename
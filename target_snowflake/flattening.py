@@ -4,6 +4,11 @@ import itertools
 import json
 import re
 
+# Flattened keys of this length or longer get shortened by flatten_key
+MAX_KEY_LENGTH = 255
+
+_MISSING = object()
+
 
 def flatten_key(k, parent_key, sep):
     """
@@ -18,7 +23,7 @@ def flatten_key(k, parent_key, sep):
     full_key = parent_key + [k]
     inflected_key = full_key.copy()
     reducer_index = 0
-    while len(sep.join(inflected_key)) >= 255 and reducer_index < len(inflected_key):
+    while len(sep.join(inflected_key)) >= MAX_KEY_LENGTH and reducer_index < len(inflected_key):
         reduced_key = re.sub(r'[a-z]', '', inflection.camelize(inflected_key[reducer_index]))
         inflected_key[reducer_index] = \
             (reduced_key if len(reduced_key) > 1 else inflected_key[reducer_index][0:3]).lower()
@@ -87,6 +92,23 @@ def _should_json_dump_value(key, value, schema=None):
     return False
 
 
+def json_dumped_columns(schema=None):
+    """
+    Get the columns of a flattened schema whose values flatten_record JSON dumps regardless of their type
+
+    Params:
+        schema: Flattened JSONSchema
+
+    Returns:
+        Frozenset of column names
+    """
+    if not schema:
+        return frozenset()
+
+    return frozenset(key for key, prop in schema.items()
+                     if 'type' in prop and set(prop['type']) == {'null', 'object', 'array'})
+
+
 # pylint: disable-msg=invalid-name
 def flatten_record(d, schema=None, parent_key=None, sep='__', level=0, max_level=0):
     """
@@ -111,3 +133,40 @@ def flatten_record(d, schema=None, parent_key=None, sep='__', level=0, max_level
             items.append((new_key, json.dumps(v) if _should_json_dump_value(k, v, schema) else v))
 
     return dict(items)
+
+
+def flatten_record_values(d, columns, schema=None, max_level=0, json_columns=None):
+    """
+    Flattens a record and returns the values of the given columns. Gives the same values
+    as flatten_record, but without building the flattened dictionary when max_level is 0
+    and the record has no keys that need to be shortened.
+
+    Params:
+        d: Record to flatten
+        columns: Flattened column names to return the values of
+        schema: Flattened JSONSchema of the record
+        max_level: Max level of auto flattening if a record has nested objects. (Default: 0)
+        json_columns: Result of json_dumped_columns(schema), pass it when flattening many records
+                      with the same schema. (Default: computed from schema)
+
+    Returns:
+        List of values in the order of columns, None for missing columns
+    """
+    if max_level > 0 or max(map(len, d), default=0) >= MAX_KEY_LENGTH:
+        flat_record = flatten_record(d, schema, max_level=max_level)
+        return list(map(flat_record.get, columns))
+
+    if json_columns is None:
+        json_columns = json_dumped_columns(schema)
+
+    # Without nesting and long keys, flattening only JSON dumps the values of objects and arrays
+    values = []
+    for column in columns:
+        value = d.get(column, _MISSING)
+        if value is _MISSING:
+            value = None
+        elif isinstance(value, (dict, list)) or column in json_columns:
+            value = json.dumps(value)
+        values.append(value)
+
+    return values
@@ -19,7 +19,9 @@ class SnowflakeUploadClient(BaseUploadClient):
         key = os.path.basename(file)
         normfile = os.path.normpath(file).replace('\\', '/')
 
-        compression = '' if self.connection_config.get('no_compression', '') else "SOURCE_COMPRESSION=GZIP"
+        compression_type = self.connection_config.get('compression_type', 'gzip').upper()
+        compression = '' if self.connection_config.get('no_compression', '') else \
+            f"SOURCE_COMPRESSION={compression_type}"
         stage = self.dblink.get_stage_name(stream)
 
         self.logger.info('Target internal stage: %s, local file: %s, key: %s', stage, normfile, key)
@@ -2,11 +2,14 @@ import unittest
 import os
 import gzip
 import tempfile
+import zstandard
+
+from unittest.mock import patch
 
 import target_snowflake.file_formats.csv as csv
 
 
-def _mock_record_to_csv_line(record, schema, data_flattening_max_level=0):
+def _mock_record_to_csv_line(record):
     return record
 
 
@@ -18,15 +21,14 @@ class TestCsv(unittest.TestCase):
 
     def test_write_record_to_uncompressed_file(self):
         records = {
-            'pk_1': 'data1,data2,data3,data4',
-            'pk_2': 'data5,data6,data7,data8'
+            'pk_1': b'data1,data2,data3,data4',
+            'pk_2': b'data5,data6,data7,data8'
         }
-        schema = {}
 
         # Write uncompressed CSV file
         csv_file = tempfile.NamedTemporaryFile(delete=False)
         with open(csv_file.name, 'wb') as f:
-            csv.write_records_to_file(f, records, schema, _mock_record_to_csv_line)
+            csv.write_records_to_file(f, records, _mock_record_to_csv_line)
 
         # Read and validate uncompressed CSV file
         with open(csv_file.name, 'rt') as f:
@@ -37,15 +39,14 @@ class TestCsv(unittest.TestCase):
 
     def test_write_records_to_compressed_file(self):
         records = {
-            'pk_1': 'data1,data2,data3,data4',
-            'pk_2': 'data5,data6,data7,data8'
+            'pk_1': b'data1,data2,data3,data4',
+            'pk_2': b'data5,data6,data7,data8'
         }
-        schema = {}
 
         # Write gzip compressed CSV file
         csv_file = tempfile.NamedTemporaryFile(delete=False)
         with gzip.open(csv_file.name, 'wb') as f:
-            csv.write_records_to_file(f, records, schema, _mock_record_to_csv_line)
+            csv.write_records_to_file(f, records, _mock_record_to_csv_line)
 
         # Read and validate gzip compressed CSV file
         with gzip.open(csv_file.name, 'rt') as f:
@@ -54,6 +55,91 @@ class TestCsv(unittest.TestCase):
 
         os.remove(csv_file.name)
 
+    def test_write_records_to_file_in_multiple_batches(self):
+        records = {f'pk_{i}': f'data{i}'.ljust(1000, 'x').encode()
+                   for i in range(csv.WRITE_BUFFER_SIZE_BYTES // 1000 * 2 + 1)}
+        expected_lines = [f'{line.decode()}\n' for line in records.values()]
+
+        # Write more lines than fits into the write buffer
+        csv_file = tempfile.NamedTemporaryFile(delete=False)
+        with open(csv_file.name, 'wb') as f:
+            csv.write_records_to_file(f, records, _mock_record_to_csv_line)
+
+        # Every line should be written once and in order
+        with open(csv_file.name, 'rt') as f:
+            self.assertEqual(f.readlines(), expected_lines)
+
+        # Written records should be removed from the records dictionary
+        self.assertEqual(records, {})
+
+        os.remove(csv_file.name)
+
+    def test_write_record_larger_than_write_buffer(self):
+        records = {
+            'pk_1': b'data1',
+            'pk_2': b'x' * csv.WRITE_BUFFER_SIZE_BYTES,
+            'pk_3': b'data3',
+        }
+
+        csv_file = tempfile.NamedTemporaryFile(delete=False)
+        with open(csv_file.name, 'wb') as f:
+            csv.write_records_to_file(f, records, _mock_record_to_csv_line)
+
+        with open(csv_file.name, 'rb') as f:
+            self.assertEqual(f.readlines(), [b'data1\n',
+                                             b'x' * csv.WRITE_BUFFER_SIZE_BYTES + b'\n',
+                                             b'data3\n'])
+
+        os.remove(csv_file.name)
+
+    def test_records_to_compressed_file(self):
+        records = {
+            'pk_1': {'key1': 1, 'key2': 'data2'},
+            'pk_2': {'key1': 3, 'key2': 'data4'},
+        }
+        schema = {'key1': {'type': ['null', 'integer']}, 'key2': {'type': ['null', 'string']}}
+
+        filename = csv.records_to_file(records, schema, compression=True)
+
+        # Generated file should be readable by standard gzip
+        self.assertTrue(filename.endswith('.csv.gz'))
+        with gzip.open(filename, 'rt') as f:
+            self.assertEqual(f.readlines(), ['1,"data2"\n',
+                                             '3,"data4"\n'])
+
+        os.remove(filename)
+
+    @patch('target_snowflake.file_formats.csv.igzip_threaded', None)
+    def test_records_to_compressed_file_without_isal(self):
+        records = {
+            'pk_1': {'key1': 1, 'key2': 'data2'},
+        }
+        schema = {'key1': {'type': ['null', 'integer']}, 'key2': {'type': ['null', 'string']}}
+
+        filename = csv.records_to_file(records, schema, compression=True)
+
+        # Standard gzip module should be used if isal is not available
+        with gzip.open(filename, 'rt') as f:
+            self.assertEqual(f.readlines(), ['1,"data2"\n'])
+
+        os.remove(filename)
+
+    def test_records_to_zstd_compressed_file(self):
+        records = {
+            'pk_1': {'key1': 1, 'key2': 'data2'},
+            'pk_2': {'key1': 3, 'key2': 'data4'},
+        }
+        schema = {'key1': {'type': ['null', 'integer']}, 'key2': {'type': ['null', 'string']}}
+
+        filename = csv.records_to_file(records, schema, compression='zstd')
+
+        self.assertTrue(filename.endswith('.csv.zst'))
+        with open(filename, 'rb') as f:
+            self.assertEqual(zstandard.ZstdDecompressor().stream_reader(f).read(),
+                             b'1,"data2"\n3,"data4"\n')
+
+        os.remove(filename)
+
     def test_record_to_csv_line(self):
         record = {
             'key1': '1',
@@ -92,7 +178,40 @@ class TestCsv(unittest.TestCase):
         }
 
         self.assertEqual(csv.record_to_csv_line(record, schema),
-                         '"1","2030-01-22","10000-01-22 12:04:22","25:01:01","I\'m good",')
+                         b'"1","2030-01-22","10000-01-22 12:04:22","25:01:01","I\'m good",')
+
+    def test_record_to_csv_line_with_scalar_types(self):
+        record = {
+            'key1': 1,
+            'key2': 0,
+            'key3': 1.5,
+            'key4': 2 ** 70,
+            'key5': float('nan'),
+            'key6': True,
+            'key7': False,
+            'key8': 'say "hi"\n',
+        }
+
+        schema = {key: {'type': ['null', 'string']} for key in record}
+
+        self.assertEqual(csv.record_to_csv_line(record, schema),
+                         b'1,0,1.5,1180591620717411303424,NaN,true,false,"say \\"hi\\"\\n"')
+
+    def test_build_csv_encoder(self):
+        schema = {
+            'key1': {'type': ['null', 'integer']},
+            'key2': {'type': ['null', 'object', 'array']},
+            'key3': {'type': ['null', 'object']},
+        }
+        encoder = csv.build_csv_encoder(schema)
+
+        # Encoder should be reusable for many records of the schema
+        self.assertEqual(encoder({'key1': 1, 'key2': 'abc', 'key3': {'a': 1}}),
+                         b'1,"\\"abc\\"","{\\"a\\": 1}"')
+        self.assertEqual(encoder({'key1': None, 'key2': None}),
+                         b',"null",')
+        self.assertEqual(encoder({}),
+                         b',,')
 
     def test_create_copy_sql(self):
         self.assertEqual(csv.create_copy_sql(table_name='foo_table',
@@ -127,3 +246,20 @@ class TestCsv(unittest.TestCase):
                          "WHEN NOT MATCHED THEN "
                          "INSERT (COL_1, COL_2, COL_3) "
                          "VALUES (s.COL_1, s.COL_2, s.COL_3)")
+
+    def test_select_from_stage(self):
+        columns = [{'name': 'COL_1', 'trans': '', 'value': None},
+                   {'name': 'COL_2', 'trans': 'parse_json', 'value': None},
+                   {'name': 'COL_3', 'trans': '', 'value': 'sysdate()'}]
+
+        self.assertEqual(csv.select_from_stage(columns, 'foo_file_format', 'foo_s3_key.csv', 'foo_stage'),
+                         "SELECT ($1) COL_1, parse_json($2) COL_2, sysdate() COL_3 "
+                         "FROM '@foo_stage/foo_s3_key.csv' "
+                         "(FILE_FORMAT => 'foo_file_format')")
+
+        # Restricting to the file pattern should exclude other keys with the same prefix
+        self.assertEqual(csv.select_from_stage(columns, 'foo_file_format', 'foo_s3_key.csv', 'foo_stage',
+                                               restrict_file_pattern=True),
+                         "SELECT ($1) COL_1, parse_json($2) COL_2, sysdate() COL_3 "
+                         "FROM '@foo_stage/foo_s3_key.csv' "
+                         "(FILE_FORMAT => 'foo_file_format', PATTERN => 'foo_s3_key\\.csv')")
@@ -50,6 +50,34 @@ class TestParquet(unittest.TestCase):
                                'key5': ['I\'m good', 'I\'m good too', 'I want to be good'],
                                'key6': [None, None, None]}))
 
+    def test_records_to_table(self):
+        records = {
+            '1': {
+                'key1': 1,
+                'key2': '2031-01-22',
+                'key3': {'nested': 'value'},
+            },
+            '2': {
+                'key1': 2,
+                'key2': None,
+                'key4': 'not in schema',
+            },
+        }
+
+        schema = {
+            'key1': {'type': ['null', 'integer']},
+            'key2': {'type': ['null', 'string']},
+            'key3': {'type': ['null', 'object']},
+        }
+
+        # Table should have the columns of the schema with flattened values
+        self.assertEqual(parquet.records_to_table(records=records, schema=schema).to_pydict(),
+                         {
+                             'key1': [1, 2],
+                             'key2': ['2031-01-22', None],
+                             'key3': ['{"nested": "value"}', None],
+                         })
+
     def test_create_copy_sql(self):
         self.assertEqual(parquet.create_copy_sql(table_name='foo_table',
                                                  stage_name='foo_stage',
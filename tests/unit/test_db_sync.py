@@ -92,6 +92,15 @@ class TestDBSync(unittest.TestCase):
         config_with_archive_load_files['archive_load_files'] = True
         self.assertGreater(len(validator(config_with_external_stage)), 0)
 
+        # Configuration with supported compression type
+        config_with_compression_type = minimal_config.copy()
+        config_with_compression_type['compression_type'] = 'zstd'
+        self.assertEqual(len(validator(config_with_compression_type)), 0)
+
+        # Configuration with not supported compression type - (nr_of_errors >= 0)
+        config_with_compression_type['compression_type'] = 'lzma'
+        self.assertGreater(len(validator(config_with_compression_type)), 0)
+
     def test_column_type_mapping(self):
         """Test JSON type to Snowflake column type mappings"""
         mapper = db_sync.column_type
@@ -212,3 +212,30 @@ class TestFlattening(unittest.TestCase):
         for idx, (should_use_flatten_schema, record, expected_output) in enumerate(test_cases):
             output = flatten_record(record, flatten_schema if should_use_flatten_schema else None)
             self.assertEqual(output, expected_output, f"Test {idx} failed. Testcase: {test_cases[idx]}")
+
+    def test_flatten_record_values(self):
+        flatten_record = flattening.flatten_record
+        flatten_record_values = flattening.flatten_record_values
+
+        schema = {
+            "c_pk": {"type": ["null", "integer"]},
+            "c_json": {"type": ["null", "object", "array"]},
+            "c_obj": {"type": ["null", "object"]},
+            "c_missing": {"type": ["null", "string"]},
+        }
+        long_key = "c_" + "x" * flattening.MAX_KEY_LENGTH
+        columns = list(schema) + [flattening.flatten_key(long_key, [], '__'), "c_obj__nested_prop1"]
+
+        test_cases = [
+            {"c_pk": 1, "c_json": None, "c_obj": {"nested_prop1": "value_1"}},
+            {"c_pk": None, "c_json": "xyz", "c_obj": [1, 2]},
+            {"c_pk": 1, long_key: "value", "c_obj": {"nested_prop1": {"nested_prop2": "value_2"}}},
+        ]
+
+        # Values should be the same as of the flattened record, with None for missing columns
+        for idx, record in enumerate(test_cases):
+            for max_level in [0, 1]:
+                flat_record = flatten_record(record, schema, max_level=max_level)
+                self.assertEqual(flatten_record_values(record, columns, schema, max_level=max_level),
+                                 [flat_record.get(column) for column in columns],
+                                 f"Test {idx} failed with max_level {max_level}. Testcase: {record}")